@@ -87,6 +87,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory is per process; point REDIS_URL at a shared Redis when running
+# more than one gunicorn worker so invalidations reach every worker.
+
+if os.environ.get('REDIS_URL'):
+  CACHES = {
+    "default": {
+      "BACKEND": "django.core.cache.backends.redis.RedisCache",
+      "LOCATION": os.environ['REDIS_URL'],
+    }
+  }
+else:
+  CACHES = {
+    "default": {
+      "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+  }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -129,6 +149,15 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# URL prefix of an nginx `internal` location aliased to MEDIA_ROOT. When set,
+# downloads are returned as X-Accel-Redirect responses and nginx sends the file.
+FILE_DOWNLOAD_ACCEL_REDIRECT = os.environ.get('FILE_DOWNLOAD_ACCEL_REDIRECT', '')
+
+# Hash used to detect duplicate uploads: 'blake3' (default) or 'sha256'.
+# Changing it invalidates stored hashes: run `manage.py rehash` after switching.
+# (Hashes from releases that only used SHA-256 are cleared by migration 0003.)
+FILE_HASH_ALGORITHM = os.environ.get('FILE_HASH_ALGORITHM', 'blake3')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -1,6 +1,23 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger('files')
 
 
 class FilesConfig(AppConfig):
   default_auto_field = "django.db.models.BigAutoField"
   name = "files"
+
+  def ready(self):
+    from .models import HASH_ALGORITHMS, new_file_hasher
+
+    if settings.FILE_HASH_ALGORITHM not in HASH_ALGORITHMS:
+      raise ImproperlyConfigured(
+        f"FILE_HASH_ALGORITHM must be one of {HASH_ALGORITHMS}, got {settings.FILE_HASH_ALGORITHM!r}"
+      )
+    # '_hashlib' means the OpenSSL backend, '_sha2'/'_sha256' the builtin fallback
+    hasher = new_file_hasher()
+    logger.info("Hashing uploads with %s (%s)", hasher.name, type(hasher).__module__)
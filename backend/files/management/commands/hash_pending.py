@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from files.models import File
+from files.tasks import compute_hash_and_dedupe
+
+
+class Command(BaseCommand):
+    help = "Hash uploads still marked pending, e.g. when a restart dropped their queued background task"
+
+    def handle(self, *args, **options):
+        pending = File.objects.filter(hash_status=File.HashStatus.PENDING, is_duplicate=False)
+        file_ids = list(pending.values_list('id', flat=True))
+        failed = 0
+        for file_id in file_ids:
+            # One unreadable file must not stop the rest from being recovered
+            try:
+                compute_hash_and_dedupe(file_id)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Could not hash file {file_id}: {e}")
+        
+        remaining = pending.count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Hashed {len(file_ids) - remaining} pending files "
+            f"({failed} failed, {remaining} still pending)"
+        ))
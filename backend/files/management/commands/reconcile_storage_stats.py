@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from files.models import StorageStats
+
+
+class Command(BaseCommand):
+    help = "Recalculate storage statistics from the file table, correcting any drift in the incremental counters"
+
+    def handle(self, *args, **options):
+        StorageStats.recalculate()
+        stats = StorageStats.objects.get(pk=1)
+        self.stdout.write(self.style.SUCCESS(
+            f"Storage stats reconciled: {stats.total_files} files "
+            f"({stats.total_unique_files} unique), "
+            f"{stats.total_storage_used} bytes used, "
+            f"{stats.total_storage_saved} bytes saved"
+        ))
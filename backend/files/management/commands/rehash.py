@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from files.models import File
+from files.tasks import find_original_id, fold_into_original
+
+
+class Command(BaseCommand):
+    help = "Re-hash every stored file, e.g. after changing FILE_HASH_ALGORITHM, or check stored hashes with --verify"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help="Report mismatched hashes without updating them")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of files hashed in parallel")
+
+    def handle(self, *args, **options):
+        # Pending uploads are left to hash_pending, which also dedupes them
+        originals = File.objects.filter(
+            is_duplicate=False, hash_status=File.HashStatus.COMPLETE
+        ).only('id', 'file', 'size', 'file_hash').order_by('pk')
+        # Keep a few files per worker in flight, so memory stays bounded however big the store is
+        batch_size = options['workers'] * 4
+        
+        checked = mismatched = folded = unreadable = 0
+        # Hashing releases the GIL, so threads spread the files across cores
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            last_pk = None
+            while True:
+                batch = originals if last_pk is None else originals.filter(pk__gt=last_pk)
+                batch = list(batch[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                
+                for file_instance, file_hash, error in pool.map(self._hash, batch):
+                    checked += 1
+                    if error is not None:
+                        unreadable += 1
+                        self.stderr.write(f"Could not read file {file_instance.id}: {error}")
+                        continue
+                    if file_hash == file_instance.file_hash:
+                        continue
+                    
+                    mismatched += 1
+                    if options['verify']:
+                        self.stderr.write(f"Hash mismatch for file {file_instance.id}")
+                        continue
+                    if self._store_hash(file_instance, file_hash):
+                        folded += 1
+        
+        action = "mismatched" if options['verify'] else "updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} files: {mismatched} hashes {action}, "
+            f"{folded} folded into existing originals, {unreadable} unreadable"
+        ))
+
+    def _hash(self, file_instance):
+        """Hash one stored file, returning the error instead when it can't be read"""
+        try:
+            return file_instance, file_instance.calculate_hash(), None
+        except OSError as e:
+            return file_instance, None, e
+
+    @transaction.atomic
+    def _store_hash(self, file_instance, file_hash):
+        """Record a file's new hash, folding it into an original that already has it"""
+        # Duplicates carry their original's hash, so move them together
+        File.objects.filter(original_file=file_instance).update(file_hash=file_hash)
+        original_id = find_original_id(file_hash, exclude_pk=file_instance.pk)
+        if original_id is None:
+            File.objects.filter(pk=file_instance.pk).update(file_hash=file_hash)
+            return False
+        
+        # The same content is already stored under the new hash (e.g. uploaded
+        # after an algorithm switch), so keep that copy and fold this one into it
+        file_instance.file_hash = file_hash
+        file_instance.hash_status = File.HashStatus.COMPLETE
+        fold_into_original(file_instance, original_id)
+        return True
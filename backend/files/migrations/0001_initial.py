@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-14 02:58
+
+import django.db.models.deletion
+import files.models
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_storage_used', models.BigIntegerField(default=0)),
+                ('total_storage_saved', models.BigIntegerField(default=0)),
+                ('total_files', models.IntegerField(default=0)),
+                ('total_unique_files', models.IntegerField(default=0)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Storage Statistics',
+                'verbose_name_plural': 'Storage Statistics',
+            },
+        ),
+        migrations.CreateModel(
+            name='File',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file', models.FileField(upload_to=files.models.file_upload_path)),
+                ('original_filename', models.CharField(max_length=255)),
+                ('file_type', models.CharField(max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('file_hash', models.CharField(max_length=64, null=True)),
+                ('is_duplicate', models.BooleanField(default=False)),
+                ('original_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='files.file')),
+            ],
+            options={
+                'ordering': ['-uploaded_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.1.15 on 2026-10-14 02:58
+
+from django.db import migrations, models
+
+
+def fold_duplicate_originals(apps, schema_editor):
+    """Keep one original per hash so uniq_file_hash_originals can be created
+
+    Concurrent uploads could store the same content twice before the
+    constraint existed; the earliest copy is kept and the rest become its
+    duplicates, with their blobs removed and the storage stats rebuilt.
+    """
+    File = apps.get_model('files', 'File')
+    StorageStats = apps.get_model('files', 'StorageStats')
+    storage = File._meta.get_field('file').storage
+
+    hashes = (
+        File.objects.filter(is_duplicate=False, file_hash__isnull=False)
+        .values('file_hash').annotate(copies=models.Count('id'))
+        .filter(copies__gt=1).values_list('file_hash', flat=True)
+    )
+    folded = False
+    for file_hash in list(hashes):
+        keeper, *extras = File.objects.filter(file_hash=file_hash, is_duplicate=False).order_by('uploaded_at')
+        for extra in extras:
+            blob_name = extra.file.name
+            File.objects.filter(original_file=extra).update(original_file=keeper)
+            File.objects.filter(pk=extra.pk).update(is_duplicate=True, original_file=keeper, file='')
+            if blob_name:
+                storage.delete(blob_name)
+            folded = True
+
+    if not folded:
+        return
+    totals = File.objects.aggregate(
+        total_potential_storage=models.Sum('size'),
+        total_storage=models.Sum('size', filter=models.Q(is_duplicate=False)),
+        total_files=models.Count('id'),
+        total_unique_files=models.Count('id', filter=models.Q(is_duplicate=False)),
+    )
+    total_storage = totals['total_storage'] or 0
+    StorageStats.objects.filter(pk=1).update(
+        total_storage_used=total_storage,
+        total_storage_saved=(totals['total_potential_storage'] or 0) - total_storage,
+        total_files=totals['total_files'],
+        total_unique_files=totals['total_unique_files'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='hash_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('complete', 'Complete')], default='complete', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['size', 'file_hash'], name='files_file_size_128caf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['is_duplicate'], name='files_file_is_dupl_fd742f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['-uploaded_at'], name='files_file_uploade_0c06ad_idx'),
+        ),
+        migrations.RunPython(fold_duplicate_originals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='file',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_duplicate', False)), fields=('file_hash',), name='uniq_file_hash_originals'),
+        ),
+    ]
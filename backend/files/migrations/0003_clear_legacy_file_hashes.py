@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def clear_legacy_file_hashes(apps, schema_editor):
+    """Drop the SHA-256 hashes stored before FILE_HASH_ALGORITHM existed
+
+    Uploads were always hashed with SHA-256 until now. Under any other
+    algorithm those hashes can never match a new upload, so clear them; a
+    cleared original is re-hashed with the configured algorithm on its
+    first size collision, or eagerly by the rehash command.
+    """
+    if settings.FILE_HASH_ALGORITHM == 'sha256':
+        return
+    File = apps.get_model('files', 'File')
+    File.objects.filter(file_hash__isnull=False).update(file_hash=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0002_hash_status_and_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_legacy_file_hashes, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,14 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import UploadedFile
+from django.db import models, transaction
+from django.utils import timezone
+import time
 import uuid
 import os
 import hashlib
+import mmap
+import blake3
 
 def file_upload_path(instance, filename):
     """Generate file path for new file upload"""
@@ -9,6 +16,92 @@ def file_upload_path(instance, filename):
     filename = f"{uuid.uuid4()}.{ext}"
     return os.path.join('uploads', filename)
 
+# Read size for the pure-Python hashing fallback. Large reads keep the number of
+# interpreter-level update() calls low; the hasher already releases the GIL on
+# large updates, so this is about per-call overhead rather than threading.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Stored files larger than this are hashed through mmap, so the hasher reads the
+# page cache directly instead of copying every block into a Python buffer
+MMAP_HASH_THRESHOLD = 100 * 1024 * 1024
+
+# Cache key for the serialized storage_stats response, and the key holding its
+# current version (see cache_version)
+STORAGE_STATS_CACHE_KEY = 'storage_stats_v1'
+STORAGE_STATS_VERSION_KEY = 'storage_stats_version'
+
+def cache_version(version_key):
+    """Return the current version for entries cached under version_key
+
+    Readers must fetch the version before reading the database. A reader that
+    raced a write then stores its stale value under the old version, which
+    nobody asks for once the writer has bumped it.
+    """
+    # Seed with the clock so a version key lost to eviction never repeats an old version
+    cache.add(version_key, time.time_ns(), timeout=None)
+    return cache.get(version_key) or 0
+
+def bump_cache_version(version_key):
+    """Retire everything cached under the current version"""
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        # Evicted: the next reader seeds a fresh version, so nothing stale is found
+        pass
+
+HASH_ALGORITHMS = ('blake3', 'sha256')
+
+def new_file_hasher(multithreaded=False):
+    """Create a hash object for the configured FILE_HASH_ALGORITHM
+
+    BLAKE3 can split a single large update() across cores; that only pays off
+    for big buffers, so callers feeding whole files opt in with multithreaded.
+    """
+    if settings.FILE_HASH_ALGORITHM == 'sha256':
+        # Use OpenSSL's EVP implementation, which picks up SHA-NI on supporting CPUs
+        return hashlib.new('sha256', usedforsecurity=False)
+    if multithreaded:
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    return blake3.blake3()
+
+def compute_file_hash(file_handle):
+    """Calculate the dedup hash of an open binary file object"""
+    if hasattr(hashlib, 'file_digest'):
+        # Python 3.11+: the read/update loop runs in C
+        return hashlib.file_digest(file_handle, new_file_hasher).hexdigest()
+    file_hash = new_file_hasher()
+    for byte_block in iter(lambda: file_handle.read(HASH_CHUNK_SIZE), b""):
+        file_hash.update(byte_block)
+    return file_hash.hexdigest()
+
+def compute_path_hash(path, size):
+    """Calculate the dedup hash of the file at path, whose size is already known"""
+    with open(path, "rb") as f:
+        if size <= MMAP_HASH_THRESHOLD:
+            return compute_file_hash(f)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            file_hash = new_file_hasher(multithreaded=True)
+            file_hash.update(mapped)
+            return file_hash.hexdigest()
+
+class HashingUploadedFile(UploadedFile):
+    """Wrap an upload so it is hashed while storage writes it, in the same pass"""
+
+    def __init__(self, upload):
+        super().__init__(upload.file, upload.name, upload.content_type, upload.size,
+                         upload.charset, upload.content_type_extra)
+        self.upload = upload
+        self.hasher = new_file_hasher()
+
+    def chunks(self, chunk_size=None):
+        # Delegate so in-memory uploads still hand over their buffer in one piece
+        for chunk in self.upload.chunks(chunk_size):
+            self.hasher.update(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
 class StorageStats(models.Model):
     total_storage_used = models.BigIntegerField(default=0)  # in bytes
     total_storage_saved = models.BigIntegerField(default=0)  # in bytes
@@ -23,19 +116,111 @@ class StorageStats(models.Model):
     def __str__(self):
         return f"Storage Stats - Last Updated: {self.last_updated}"
 
+    @property
+    def storage_saved_percentage(self):
+        """Share of the would-be storage total that deduplication saved"""
+        total_potential_storage = self.total_storage_used + self.total_storage_saved
+        if total_potential_storage <= 0:
+            return 0
+        return self.total_storage_saved / total_potential_storage * 100
+
+    @classmethod
+    def recalculate(cls):
+        """Recalculate storage statistics from the full file table"""
+        with transaction.atomic():
+            cls.objects.get_or_create(pk=1)
+            # Lock the row so concurrent deltas wait rather than being overwritten by these totals
+            stats = cls.objects.select_for_update().get(pk=1)
+            
+            totals = File.objects.aggregate(
+                # Total storage that would have been used without deduplication
+                total_potential_storage=models.Sum('size'),
+                # Total storage used (only counting unique files)
+                total_storage=models.Sum('size', filter=models.Q(is_duplicate=False)),
+                total_files=models.Count('id'),
+                total_unique_files=models.Count('id', filter=models.Q(is_duplicate=False)),
+            )
+            total_storage = totals['total_storage'] or 0
+            
+            # Storage saved is the difference between what would have been used and what is actually used
+            stats.total_storage_used = total_storage
+            stats.total_storage_saved = (totals['total_potential_storage'] or 0) - total_storage
+            stats.total_files = totals['total_files']
+            stats.total_unique_files = totals['total_unique_files']
+            stats.save(update_fields=[
+                'total_storage_used', 'total_storage_saved', 'total_files',
+                'total_unique_files', 'last_updated',
+            ])
+            cls.invalidate_cache()
+
+    @classmethod
+    def apply_delta(cls, storage_used=0, storage_saved=0, files=0, unique_files=0):
+        """Add the given deltas to the statistics in a single UPDATE
+
+        The arithmetic happens in the database, so concurrent uploads can't
+        lose each other's updates and no row lock needs to be taken.
+        """
+        updated = cls.objects.filter(pk=1).update(
+            total_storage_used=models.F('total_storage_used') + storage_used,
+            total_storage_saved=models.F('total_storage_saved') + storage_saved,
+            total_files=models.F('total_files') + files,
+            total_unique_files=models.F('total_unique_files') + unique_files,
+            last_updated=timezone.now(),
+        )
+        if not updated:
+            # No stats row yet, so build it from the current table
+            cls.recalculate()
+        else:
+            cls.invalidate_cache()
+
+    @classmethod
+    def invalidate_cache(cls):
+        """Retire the cached storage_stats response once the change is committed"""
+        transaction.on_commit(lambda: bump_cache_version(STORAGE_STATS_VERSION_KEY))
+
+    @classmethod
+    def record_file(cls, size, is_duplicate, sign=1):
+        """Apply one file being added (sign=1) or removed (sign=-1) to the statistics"""
+        cls.apply_delta(
+            storage_used=0 if is_duplicate else sign * size,
+            storage_saved=sign * size if is_duplicate else 0,
+            files=sign,
+            unique_files=0 if is_duplicate else sign,
+        )
+
 class File(models.Model):
+    class HashStatus(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        COMPLETE = 'complete', 'Complete'
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file = models.FileField(upload_to=file_upload_path)
     original_filename = models.CharField(max_length=255)
     file_type = models.CharField(max_length=100)
     size = models.BigIntegerField()
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    file_hash = models.CharField(max_length=64, null=True)  # SHA-256 hash
+    file_hash = models.CharField(max_length=64, null=True)  # FILE_HASH_ALGORITHM hash, computed on first size collision
+    hash_status = models.CharField(max_length=10, choices=HashStatus.choices, default=HashStatus.COMPLETE)
     is_duplicate = models.BooleanField(default=False)
     original_file = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='duplicates')
     
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Serves the size-collision probe and the unhashed-candidate backfill
+            models.Index(fields=['size', 'file_hash']),
+            models.Index(fields=['is_duplicate']),
+            # Cursor pagination seeks on the list's default ordering
+            models.Index(fields=['-uploaded_at']),
+        ]
+        constraints = [
+            # At most one stored original per hash; duplicates point at it
+            models.UniqueConstraint(
+                fields=['file_hash'],
+                condition=models.Q(is_duplicate=False),
+                name='uniq_file_hash_originals'
+            ),
+        ]
     
     def __str__(self):
         return self.original_filename
@@ -48,9 +233,5 @@ class File(models.Model):
         super().delete(*args, **kwargs)
 
     def calculate_hash(self):
-        """Calculate SHA-256 hash of the file"""
-        sha256_hash = hashlib.sha256()
-        with open(self.file.path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+        """Calculate the dedup hash of the file"""
+        return compute_path_hash(self.file.path, self.size)
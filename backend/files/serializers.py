@@ -5,5 +5,5 @@ class FileSerializer(serializers.ModelSerializer):
     class Meta:
         model = File
         fields = ['id', 'file', 'original_filename', 'file_type', 'size', 
-                 'uploaded_at', 'is_duplicate', 'original_file']
-        read_only_fields = ['id', 'uploaded_at', 'is_duplicate', 'original_file'] 
\ No newline at end of file
+                 'uploaded_at', 'is_duplicate', 'original_file', 'hash_status']
+        read_only_fields = ['id', 'uploaded_at', 'is_duplicate', 'original_file', 'hash_status'] 
\ No newline at end of file
@@ -0,0 +1,104 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, connection, transaction
+
+from .models import File, StorageStats
+
+logger = logging.getLogger('files')
+
+# In-process pool for post-upload work. Hashing releases the GIL, so these
+# threads run alongside the request threads instead of competing with them.
+executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='files-hash')
+
+
+def schedule_hash_and_dedupe(file_id):
+    """Queue compute_hash_and_dedupe to run once the current transaction commits"""
+    transaction.on_commit(lambda: executor.submit(_run_task, compute_hash_and_dedupe, file_id))
+
+
+def _run_task(task, *args):
+    """Run a background task, logging failures instead of losing them in the pool"""
+    try:
+        task(*args)
+    except Exception:
+        logger.exception(f"Background task {task.__name__} failed for {args}")
+    finally:
+        # Each worker thread opens its own connection; don't leave it dangling
+        connection.close()
+
+
+def compute_hash_and_dedupe(file_id):
+    """Hash a stored upload and fold it into an existing original if it is a duplicate"""
+    unhashed = File.objects.filter(pk=file_id, is_duplicate=False, file_hash__isnull=True)
+    file_instance = unhashed.first()
+    if file_instance is None:
+        # Deleted, or already hashed by a same-size upload in the meantime
+        return
+
+    # Hash outside the transaction so no lock is held while reading the file
+    file_hash = file_instance.calculate_hash()
+
+    with transaction.atomic():
+        file_instance = unhashed.select_for_update().first()
+        if file_instance is None:
+            return
+
+        file_instance.file_hash = file_hash
+        file_instance.hash_status = File.HashStatus.COMPLETE
+
+        original_id = find_original_id(file_hash, exclude_pk=file_id)
+        if original_id is None:
+            try:
+                with transaction.atomic():
+                    file_instance.save(update_fields=['file_hash', 'hash_status'])
+                return
+            except IntegrityError:
+                # Another task committed the same hash after the probe above (its
+                # write wasn't visible yet); the constraint caught it, so use that row
+                original_id = find_original_id(file_hash, exclude_pk=file_id)
+                if original_id is None:
+                    raise
+
+        # Same content arrived concurrently under another row: keep that one
+        fold_into_original(file_instance, original_id)
+
+
+def find_original_id(file_hash, exclude_pk=None):
+    """Return the id of the stored original with this hash (other than exclude_pk), if any"""
+    originals = File.objects.filter(file_hash=file_hash, is_duplicate=False)
+    if exclude_pk is not None:
+        originals = originals.exclude(pk=exclude_pk)
+    # At most one row can match, so skip Meta.ordering (and the sort it costs);
+    # the partial unique index on originals then answers the probe directly
+    ids = originals.order_by().values_list('id', flat=True)[:1]
+    return ids[0] if ids else None
+
+
+def fold_into_original(file_instance, original_id):
+    """Turn a stored original into a duplicate of another original with the same content
+
+    Must run inside a transaction; the blob is removed once it commits.
+    """
+    blob_path = file_instance.file.path
+    file_instance.is_duplicate = True
+    file_instance.original_file_id = original_id
+    file_instance.file = None
+    file_instance.save(update_fields=['file_hash', 'hash_status', 'is_duplicate', 'original_file', 'file'])
+    # Anything linked to this row now links to the surviving original
+    File.objects.filter(original_file=file_instance.pk).update(original_file=original_id)
+
+    # The file's bytes move from "used" to "saved"
+    StorageStats.apply_delta(
+        storage_used=-file_instance.size,
+        storage_saved=file_instance.size,
+        unique_files=-1,
+    )
+    transaction.on_commit(lambda: _remove_blob(blob_path))
+
+
+def _remove_blob(path):
+    """Delete a stored file that is no longer referenced"""
+    if os.path.isfile(path):
+        os.remove(path)
@@ -1,15 +1,25 @@
 import os
+import uuid
 import tempfile
-from django.test import TestCase
+import blake3
+from django.test import TestCase, override_settings
+from django.db import DatabaseError, IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from io import StringIO
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
+from django.core.cache import cache
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from .models import File, StorageStats
-from .views import FileFilter
+from .views import FileFilter, FileViewSet, guess_file_type
+from .tasks import compute_hash_and_dedupe
 from django.db.models import QuerySet
 from datetime import datetime, timedelta
 import logging
+from unittest import mock
+from django.conf import settings
 
 # Disable logging during tests
 logging.disable(logging.CRITICAL)
@@ -61,6 +71,29 @@ class FileModelTests(TestCase):
         """Test the string representation of a File object"""
         self.assertEqual(str(self.file), "test_file.txt")
     
+    def test_calculate_hash(self):
+        """Test the stored file hash matches its content, including via mmap"""
+        expected = blake3.blake3(b"Test file content").hexdigest()
+        self.assertEqual(self.file.calculate_hash(), expected)
+        with mock.patch('files.models.MMAP_HASH_THRESHOLD', 0):
+            self.assertEqual(self.file.calculate_hash(), expected)
+    
+    def test_only_one_original_per_hash(self):
+        """Test the database rejects a second original with the same hash"""
+        with self.assertRaises(IntegrityError):
+            File.objects.create(
+                original_filename="copy.txt",
+                file_type="text/plain",
+                size=self.file.size,
+                file_hash="test_hash",
+                is_duplicate=False
+            )
+    
+    def test_storage_saved_percentage(self):
+        """Test the saved percentage, including an empty store"""
+        self.assertEqual(StorageStats(total_storage_used=300, total_storage_saved=100).storage_saved_percentage, 25)
+        self.assertEqual(StorageStats().storage_saved_percentage, 0)
+    
     def test_file_deletion(self):
         """Test that a file is properly deleted"""
         file_id = self.file.id
@@ -74,12 +107,14 @@ class FileViewSetTests(APITestCase):
     def setUp(self):
         # Create a test client
         self.client = APIClient()
+        cache.clear()
         
         # Create test files
         self.create_test_files()
         
         # Create storage stats
         self.storage_stats = StorageStats.objects.create(
+            pk=1,
             total_storage_used=1000,
             total_storage_saved=500,
             total_files=2,
@@ -132,7 +167,45 @@ class FileViewSetTests(APITestCase):
         """Test listing all files"""
         response = self.client.get('/api/files/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
+    
+    def test_list_files_cursor_pagination(self):
+        """Test the file list is split into cursor pages, newest first"""
+        response = self.client.get('/api/files/', {'page_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], str(self.file2.id))
+        self.assertIsNone(response.data['previous'])
+        self.assertNotIn('count', response.data)
+        
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['id'], str(self.file1.id))
+        self.assertIsNone(response.data['next'])
+    
+    def test_list_files_single_query(self):
+        """Test listing duplicates doesn't fetch their originals row by row"""
+        with self.assertNumQueries(1):
+            self.client.get('/api/files/')
+    
+    def test_search_files(self):
+        """Test searching files by name"""
+        response = self.client.get('/api/files/', {'search': 'duplicate'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['original_filename'], "duplicate_file.txt")
+    
+    def test_invalid_date_filter_returns_400(self):
+        """Test listing with a malformed date filter is a client error"""
+        response = self.client.get('/api/files/', {'end_date': '2025-13-40'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_search_files_without_distinct(self):
+        """Test searching by filename is a single plain query (no DISTINCT)"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/files/', {'search': 'file'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('DISTINCT', queries[0]['sql'].upper())
     
     def test_retrieve_file(self):
         """Test retrieving a specific file"""
@@ -140,12 +213,327 @@ class FileViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['original_filename'], "unique_file.txt")
     
+    def test_upload_file(self):
+        """Test an in-memory upload of a new size is hashed as it is stored"""
+        content = b"Brand new content"
+        upload = SimpleUploadedFile("new_file.txt", content, content_type="text/plain")
+        response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.data['is_duplicate'])
+        self.assertEqual(response.data['hash_status'], File.HashStatus.COMPLETE)
+        
+        new_file = File.objects.get(id=response.data['id'])
+        self.addCleanup(os.remove, new_file.file.path)
+        self.assertEqual(new_file.file_hash, blake3.blake3(content).hexdigest())
+        with open(new_file.file.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+    
+    def test_guess_file_type(self):
+        """Test MIME types are guessed by extension, case-insensitively"""
+        self.assertEqual(guess_file_type("report.PDF"), "application/pdf")
+        self.assertEqual(guess_file_type("notes.txt"), "text/plain")
+        self.assertEqual(guess_file_type("backup.tar.gz"), "application/x-tar")
+        self.assertEqual(guess_file_type("backup.tar.bz2"), "application/x-tar")
+        self.assertEqual(guess_file_type("no_extension"), "application/octet-stream")
+    
+    def test_upload_streamed_hash_conflict(self):
+        """Test an upload whose streamed hash is already taken is left to the background task"""
+        content = b"Racing content"
+        File.objects.create(
+            original_filename="racer.txt",
+            file_type="text/plain",
+            size=len(content) + 1,
+            file_hash=blake3.blake3(content).hexdigest()
+        )
+        with mock.patch('files.views.schedule_hash_and_dedupe') as schedule:
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("racing.txt", content, content_type="text/plain")},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        new_file = File.objects.get(id=response.data['id'])
+        self.addCleanup(os.remove, new_file.file.path)
+        self.assertIsNone(new_file.file_hash)
+        schedule.assert_called_once_with(new_file.id)
+    
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_upload_spooled_file(self):
+        """Test a spooled upload of a new size is stored without hashing"""
+        content = b"Brand new content"
+        upload = SimpleUploadedFile("new_file.txt", content, content_type="text/plain")
+        response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(response.data['is_duplicate'])
+        self.assertEqual(response.data['hash_status'], File.HashStatus.PENDING)
+        
+        new_file = File.objects.get(id=response.data['id'])
+        self.addCleanup(os.remove, new_file.file.path)
+        self.assertIsNone(new_file.file_hash)
+        with open(new_file.file.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+    
+    def test_upload_duplicate_file(self):
+        """Test uploading identical content is stored as a duplicate"""
+        content = b"Repeated content"
+        first = self.client.post(
+            '/api/files/',
+            {'file': SimpleUploadedFile("first.txt", content, content_type="text/plain")},
+            format='multipart'
+        )
+        original = File.objects.get(id=first.data['id'])
+        self.addCleanup(os.remove, original.file.path)
+        
+        response = self.client.post(
+            '/api/files/',
+            {'file': SimpleUploadedFile("second.txt", content, content_type="text/plain")},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['is_duplicate'])
+        self.assertEqual(response.data['original_file_id'], str(original.id))
+        
+        # The original's hash was recorded as it was written
+        original.refresh_from_db()
+        self.assertEqual(original.file_hash, blake3.blake3(content).hexdigest())
+    
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_upload_duplicate_spooled_to_disk(self):
+        """Test uploads Django spooled to a temporary file are hashed and deduplicated"""
+        content = b"Unique file CONTENT"
+        response = self.client.post(
+            '/api/files/',
+            {'file': SimpleUploadedFile("spooled.txt", content, content_type="text/plain")},
+            format='multipart'
+        )
+        new_file = File.objects.get(id=response.data['id'])
+        self.addCleanup(os.remove, new_file.file.path)
+        self.assertEqual(new_file.file_hash, blake3.blake3(content).hexdigest())
+        with open(new_file.file.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+    
+    def test_upload_with_unreadable_same_size_file(self):
+        """Test a same-size stored file with a missing blob doesn't fail the upload"""
+        broken = File.objects.create(
+            file=SimpleUploadedFile("broken.txt", b"gone"),
+            original_filename="broken.txt",
+            file_type="text/plain",
+            size=4
+        )
+        os.remove(broken.file.path)
+        
+        response = self.client.post(
+            '/api/files/',
+            {'file': SimpleUploadedFile("fine.txt", b"fine", content_type="text/plain")},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        new_file = File.objects.get(id=response.data['id'])
+        self.addCleanup(os.remove, new_file.file.path)
+        self.assertEqual(new_file.file_hash, blake3.blake3(b"fine").hexdigest())
+        broken.refresh_from_db()
+        self.assertIsNone(broken.file_hash)
+    
+    def test_backfill_runs_outside_upload_transaction(self):
+        """Test same-size stored files are hashed before the upload's transaction opens"""
+        File.objects.filter(pk=self.file1.pk).update(file_hash=None)
+        depth = len(connection.savepoint_ids)
+        depths = []
+        with mock.patch('files.views.compute_hash_and_dedupe',
+                        side_effect=lambda file_id: depths.append(len(connection.savepoint_ids))):
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("other.txt", b"Unique file CONTENT", content_type="text/plain")},
+                format='multipart'
+            )
+        self.addCleanup(os.remove, File.objects.get(id=response.data['id']).file.path)
+        self.assertEqual(depths, [depth])
+    
+    def test_backfill_skips_queued_files(self):
+        """Test a same-size file already queued for background hashing isn't hashed again"""
+        File.objects.filter(pk=self.file1.pk).update(file_hash=None, hash_status=File.HashStatus.PENDING)
+        with mock.patch('files.views.compute_hash_and_dedupe') as backfill:
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("other.txt", b"Unique file CONTENT", content_type="text/plain")},
+                format='multipart'
+            )
+        self.addCleanup(os.remove, File.objects.get(id=response.data['id']).file.path)
+        backfill.assert_not_called()
+    
+    def test_upload_same_size_different_content(self):
+        """Test a same-size upload with different content is stored as unique"""
+        response = self.client.post(
+            '/api/files/',
+            {'file': SimpleUploadedFile("other.txt", b"Unique file CONTENT", content_type="text/plain")},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.data['is_duplicate'])
+        
+        new_file = File.objects.get(id=response.data['id'])
+        self.addCleanup(os.remove, new_file.file.path)
+        self.assertIsNotNone(new_file.file_hash)
+    
+    def test_failed_upload_is_rolled_back(self):
+        """Test a failure while recording an upload leaves no row or stored file"""
+        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
+        stored_before = set(os.listdir(upload_dir))
+        
+        with mock.patch('files.views.StorageStats.record_file', side_effect=RuntimeError("boom")):
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("broken.txt", b"Broken upload", content_type="text/plain")},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.filter(original_filename="broken.txt").exists())
+        self.assertEqual(set(os.listdir(upload_dir)), stored_before)
+    
+    def test_failed_streamed_hash_is_rolled_back(self):
+        """Test a failure while storing the streamed hash leaves no row or stored file"""
+        upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
+        stored_before = set(os.listdir(upload_dir))
+        
+        with mock.patch.object(FileViewSet, '_record_streamed_hash', side_effect=DatabaseError("boom")):
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("unhashed.txt", b"Unhashed upload", content_type="text/plain")},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.filter(original_filename="unhashed.txt").exists())
+        self.assertEqual(set(os.listdir(upload_dir)), stored_before)
+    
+    def test_error_after_commit_keeps_stored_file(self):
+        """Test a failure after an upload is committed doesn't remove its stored file"""
+        with mock.patch.object(FileViewSet, 'get_serializer', side_effect=RuntimeError("boom")):
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("committed.txt", b"Committed upload", content_type="text/plain")},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        new_file = File.objects.get(original_filename="committed.txt")
+        self.addCleanup(os.remove, new_file.file.path)
+        self.assertTrue(os.path.exists(new_file.file.path))
+    
     def test_delete_file(self):
         """Test deleting a file"""
         response = self.client.delete(f'/api/files/{self.file1.id}/')
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(File.objects.filter(id=self.file1.id).count(), 0)
     
+    def test_delete_original_keeps_duplicates(self):
+        """Test deleting an original removes its blob and unlinks its duplicates"""
+        blob_path = self.file1.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(f'/api/files/{self.file1.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        
+        # One narrow SELECT, the unlink, the DELETE and the stats UPDATE
+        sql = [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(sql), 4)
+        self.assertNotIn('"files_file"."original_filename"', sql[0])
+        self.assertFalse(os.path.exists(blob_path))
+        self.file2.refresh_from_db()
+        self.assertIsNone(self.file2.original_file_id)
+    
+    def test_delete_lost_race(self):
+        """Test a delete whose row was removed concurrently leaves the stats alone"""
+        with mock.patch.object(QuerySet, '_raw_delete', return_value=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete(f'/api/files/{self.file1.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(os.path.exists(self.file1.file.path))
+        self.storage_stats.refresh_from_db()
+        self.assertEqual(self.storage_stats.total_files, 2)
+        self.assertEqual(self.storage_stats.total_storage_used, 1000)
+    
+    def test_delete_missing_file(self):
+        """Test deleting an unknown or malformed id returns 404"""
+        response = self.client.delete(f'/api/files/{uuid.uuid4()}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete('/api/files/not-a-uuid/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_reconcile_storage_stats_command(self):
+        """Test the reconcile command rebuilds the stats from the file table"""
+        call_command('reconcile_storage_stats', stdout=StringIO())
+        self.storage_stats.refresh_from_db()
+        self.assertEqual(self.storage_stats.total_storage_used, self.file1.size)
+        self.assertEqual(self.storage_stats.total_storage_saved, self.file2.size)
+        self.assertEqual(self.storage_stats.total_files, 2)
+        self.assertEqual(self.storage_stats.total_unique_files, 1)
+    
+    def test_delete_file_updates_storage_stats(self):
+        """Test deleting a file subtracts it from the storage stats"""
+        self.client.delete(f'/api/files/{self.file2.id}/')
+        self.storage_stats.refresh_from_db()
+        self.assertEqual(self.storage_stats.total_storage_used, 1000)
+        self.assertEqual(self.storage_stats.total_storage_saved, 500 - self.file2.size)
+        self.assertEqual(self.storage_stats.total_files, 1)
+        self.assertEqual(self.storage_stats.total_unique_files, 1)
+    
+    def test_upload_updates_storage_stats(self):
+        """Test uploading a unique file adds it to the storage stats"""
+        content = b"Extra content"
+        response = self.client.post(
+            '/api/files/',
+            {'file': SimpleUploadedFile("extra.txt", content, content_type="text/plain")},
+            format='multipart'
+        )
+        self.addCleanup(os.remove, File.objects.get(id=response.data['id']).file.path)
+        self.storage_stats.refresh_from_db()
+        self.assertEqual(self.storage_stats.total_storage_used, 1000 + len(content))
+        self.assertEqual(self.storage_stats.total_storage_saved, 500)
+        self.assertEqual(self.storage_stats.total_files, 3)
+        self.assertEqual(self.storage_stats.total_unique_files, 2)
+    
+    def test_upload_duplicate_single_insert(self):
+        """Test a duplicate upload inserts its row once and loads only the original's id"""
+        File.objects.filter(pk=self.file1.pk).update(file_hash=blake3.blake3(b"Unique file content").hexdigest())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("again.txt", b"Unique file content", content_type="text/plain")},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['original_file_id'], str(self.file1.id))
+        
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(len([q for q in sql if q.startswith('INSERT INTO "files_file"')]), 1)
+        self.assertFalse([q for q in sql if q.startswith('UPDATE "files_file"')])
+        lookup = [q for q in sql if '"files_file"."file_hash" =' in q]
+        self.assertEqual(len(lookup), 1)
+        self.assertNotIn('"files_file"."original_filename"', lookup[0])
+        # At most one original can match, so the probe isn't sorted
+        self.assertNotIn('ORDER BY', lookup[0])
+    
+    def test_download_file(self):
+        """Test downloading a file streams its content"""
+        response = self.client.get(f'/api/files/{self.file1.id}/download/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"Unique file content")
+        self.assertIn('attachment', response['Content-Disposition'])
+    
+    def test_download_duplicate_single_query(self):
+        """Test downloading a duplicate loads its original in the same query"""
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/files/{self.file2.id}/download/')
+        self.assertEqual(b"".join(response.streaming_content), b"Unique file content")
+    
+    @override_settings(FILE_DOWNLOAD_ACCEL_REDIRECT='/protected/')
+    def test_download_file_accel_redirect(self):
+        """Test downloads are delegated to nginx when configured"""
+        response = self.client.get(f'/api/files/{self.file2.id}/download/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.file1.file.name}')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(response.content, b"")
+    
     def test_storage_stats(self):
         """Test retrieving storage stats"""
         response = self.client.get('/api/files/storage_stats/')
@@ -155,6 +543,41 @@ class FileViewSetTests(APITestCase):
         self.assertEqual(response.data['total_files'], 2)
         self.assertEqual(response.data['total_unique_files'], 1)
     
+    def test_storage_stats_refreshed_after_upload(self):
+        """Test the cached storage stats are invalidated by an upload"""
+        self.client.get('/api/files/storage_stats/')
+        
+        # Same size as the existing files, so it is deduplicated synchronously
+        content = b"Unique file CONTENT"
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("fresh.txt", content, content_type="text/plain")},
+                format='multipart'
+            )
+        self.addCleanup(os.remove, File.objects.get(id=response.data['id']).file.path)
+        
+        response = self.client.get('/api/files/storage_stats/')
+        self.assertEqual(response.data['total_storage_used'], 1000 + len(content))
+        self.assertEqual(response.data['total_files'], 3)
+    
+    def test_storage_stats_stale_refill_not_served(self):
+        """Test stats read before a concurrent write commits aren't served after it"""
+        stale = StorageStats.objects.get(pk=1)
+        
+        def read_racing_write():
+            # The write commits while this request still holds the old row
+            with self.captureOnCommitCallbacks(execute=True):
+                StorageStats.apply_delta(files=1)
+            return stale
+        
+        with mock.patch.object(StorageStats.objects, 'first', side_effect=read_racing_write):
+            response = self.client.get('/api/files/storage_stats/')
+        self.assertEqual(response.data['total_files'], 2)
+        
+        response = self.client.get('/api/files/storage_stats/')
+        self.assertEqual(response.data['total_files'], 3)
+    
     def test_file_types(self):
         """Test retrieving file types"""
         response = self.client.get('/api/files/file_types/')
@@ -162,6 +585,39 @@ class FileViewSetTests(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0], "text/plain")
     
+    def test_file_types_refreshed_after_upload(self):
+        """Test the cached file types are invalidated by an upload"""
+        self.client.get('/api/files/file_types/')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/files/',
+                {'file': SimpleUploadedFile("photo.png", b"Unique file CONTENT", content_type="image/png")},
+                format='multipart'
+            )
+        self.addCleanup(os.remove, File.objects.get(id=response.data['id']).file.path)
+        
+        response = self.client.get('/api/files/file_types/')
+        self.assertEqual(response.data, ["image/png", "text/plain"])
+    
+    def test_file_types_stale_refill_not_served(self):
+        """Test types read before a concurrent upload commits aren't served after it"""
+        real_set = cache.set
+        
+        def set_after_racing_upload(*args, **kwargs):
+            # The upload commits between this request's query and its cache.set
+            with self.captureOnCommitCallbacks(execute=True):
+                File.objects.create(original_filename="photo.png", file_type="image/png", size=1, file_hash="png_hash")
+                FileViewSet()._invalidate_file_types()
+            real_set(*args, **kwargs)
+        
+        with mock.patch.object(cache, 'set', side_effect=set_after_racing_upload):
+            response = self.client.get('/api/files/file_types/')
+        self.assertEqual(response.data, ["text/plain"])
+        
+        response = self.client.get('/api/files/file_types/')
+        self.assertEqual(response.data, ["image/png", "text/plain"])
+    
     def test_size_ranges(self):
         """Test retrieving size ranges"""
         response = self.client.get('/api/files/size_ranges/')
@@ -175,6 +631,193 @@ class FileViewSetTests(APITestCase):
         self.assertTrue(len(response.data) > 0)
 
 
+class HashTaskTests(TestCase):
+    """Test the background hash and dedupe task"""
+    
+    def setUp(self):
+        StorageStats.objects.create(
+            pk=1,
+            total_storage_used=10,
+            total_storage_saved=0,
+            total_files=1,
+            total_unique_files=1
+        )
+        self.pending = File.objects.create(
+            file=SimpleUploadedFile("pending.txt", b"Pending content"),
+            original_filename="pending.txt",
+            file_type="text/plain",
+            size=len(b"Pending content"),
+            hash_status=File.HashStatus.PENDING
+        )
+        self.blob_path = self.pending.file.path
+    
+    def tearDown(self):
+        if os.path.exists(self.blob_path):
+            os.remove(self.blob_path)
+    
+    def test_unique_file_is_hashed(self):
+        """Test a pending file with no match just records its hash"""
+        compute_hash_and_dedupe(self.pending.id)
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.file_hash, blake3.blake3(b"Pending content").hexdigest())
+        self.assertEqual(self.pending.hash_status, File.HashStatus.COMPLETE)
+        self.assertFalse(self.pending.is_duplicate)
+    
+    def test_duplicate_is_folded_into_original(self):
+        """Test a pending file matching an original becomes its duplicate"""
+        original = File.objects.create(
+            original_filename="original.txt",
+            file_type="text/plain",
+            size=self.pending.size,
+            file_hash=blake3.blake3(b"Pending content").hexdigest()
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            compute_hash_and_dedupe(self.pending.id)
+        
+        self.pending.refresh_from_db()
+        self.assertTrue(self.pending.is_duplicate)
+        self.assertEqual(self.pending.original_file_id, original.id)
+        self.assertFalse(self.pending.file)
+        self.assertFalse(os.path.exists(self.blob_path))
+        
+        stats = StorageStats.objects.get(pk=1)
+        self.assertEqual(stats.total_storage_used, 10 - self.pending.size)
+        self.assertEqual(stats.total_storage_saved, self.pending.size)
+        self.assertEqual(stats.total_unique_files, 0)
+    
+    def test_concurrent_original_is_folded_on_conflict(self):
+        """Test a task whose probe missed a concurrent original folds into it on the constraint error"""
+        content_hash = blake3.blake3(b"Pending content").hexdigest()
+        original = File.objects.create(
+            original_filename="original.txt",
+            file_type="text/plain",
+            size=self.pending.size,
+            file_hash=content_hash
+        )
+        # The first probe runs before the other task's commit is visible
+        with mock.patch('files.tasks.find_original_id', side_effect=[None, original.id]):
+            with self.captureOnCommitCallbacks(execute=True):
+                compute_hash_and_dedupe(self.pending.id)
+        
+        self.pending.refresh_from_db()
+        self.assertTrue(self.pending.is_duplicate)
+        self.assertEqual(self.pending.original_file_id, original.id)
+        self.assertFalse(os.path.exists(self.blob_path))
+        self.assertEqual(StorageStats.objects.get(pk=1).total_unique_files, 0)
+    
+    def test_hash_pending_command(self):
+        """Test the hash_pending command finishes uploads whose task was lost"""
+        call_command('hash_pending', stdout=StringIO())
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.hash_status, File.HashStatus.COMPLETE)
+        self.assertEqual(self.pending.file_hash, blake3.blake3(b"Pending content").hexdigest())
+    
+    def test_hash_pending_command_skips_unreadable_files(self):
+        """Test a pending file with a missing blob doesn't stop the others being hashed"""
+        broken = File.objects.create(
+            file=SimpleUploadedFile("broken.txt", b"Broken content"),
+            original_filename="broken.txt",
+            file_type="text/plain",
+            size=len(b"Broken content"),
+            hash_status=File.HashStatus.PENDING
+        )
+        os.remove(broken.file.path)
+        
+        stdout = StringIO()
+        call_command('hash_pending', stdout=stdout, stderr=StringIO())
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.hash_status, File.HashStatus.COMPLETE)
+        self.assertIn("1 failed, 1 still pending", stdout.getvalue())
+    
+    def test_rehash_command_updates_stale_hashes(self):
+        """Test rehash rewrites an outdated hash on the original and its duplicates"""
+        File.objects.filter(pk=self.pending.pk).update(file_hash="stale", hash_status=File.HashStatus.COMPLETE)
+        duplicate = File.objects.create(
+            original_filename="copy.txt",
+            file_type="text/plain",
+            size=self.pending.size,
+            file_hash="stale",
+            is_duplicate=True,
+            original_file=self.pending
+        )
+        
+        call_command('rehash', '--verify', stdout=StringIO(), stderr=StringIO())
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.file_hash, "stale")
+        
+        call_command('rehash', stdout=StringIO())
+        expected = blake3.blake3(b"Pending content").hexdigest()
+        self.pending.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertEqual(self.pending.file_hash, expected)
+        self.assertEqual(duplicate.file_hash, expected)
+
+    
+    def test_rehash_command_folds_same_content_originals(self):
+        """Test rehash folds an original whose new hash is already stored under another original"""
+        File.objects.filter(pk=self.pending.pk).update(file_hash="old-sha256-value", hash_status=File.HashStatus.COMPLETE)
+        duplicate = File.objects.create(
+            original_filename="copy.txt",
+            file_type="text/plain",
+            size=self.pending.size,
+            file_hash="old-sha256-value",
+            is_duplicate=True,
+            original_file=self.pending
+        )
+        newer = File.objects.create(
+            file=SimpleUploadedFile("newer.txt", b"Pending content"),
+            original_filename="newer.txt",
+            file_type="text/plain",
+            size=self.pending.size,
+            file_hash=blake3.blake3(b"Pending content").hexdigest()
+        )
+        self.addCleanup(os.remove, newer.file.path)
+        StorageStats.recalculate()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rehash', stdout=StringIO())
+        
+        self.pending.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertTrue(self.pending.is_duplicate)
+        self.assertEqual(self.pending.original_file_id, newer.id)
+        self.assertEqual(duplicate.original_file_id, newer.id)
+        self.assertEqual(duplicate.file_hash, newer.file_hash)
+        self.assertFalse(os.path.exists(self.blob_path))
+        
+        stats = StorageStats.objects.get(pk=1)
+        self.assertEqual(stats.total_unique_files, 1)
+        self.assertEqual(stats.total_storage_used, newer.size)
+
+    
+    def test_rehash_command_continues_past_unreadable_files(self):
+        """Test rehash counts files it can't read and still updates the rest"""
+        File.objects.filter(pk=self.pending.pk).update(file_hash="stale", hash_status=File.HashStatus.COMPLETE)
+        unreadable = File.objects.create(
+            file=SimpleUploadedFile("locked.txt", b"Locked content"),
+            original_filename="locked.txt",
+            file_type="text/plain",
+            size=len(b"Locked content"),
+            file_hash="stale-locked"
+        )
+        self.addCleanup(os.remove, unreadable.file.path)
+        
+        real_hash = File.calculate_hash
+        def calculate_hash(file_instance):
+            if file_instance.pk == unreadable.pk:
+                raise PermissionError("Permission denied")
+            return real_hash(file_instance)
+        
+        stdout = StringIO()
+        with mock.patch.object(File, 'calculate_hash', calculate_hash):
+            call_command('rehash', '--workers', '1', stdout=stdout, stderr=StringIO())
+        
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.file_hash, blake3.blake3(b"Pending content").hexdigest())
+        self.assertIn("Checked 2 files", stdout.getvalue())
+        self.assertIn("1 unreadable", stdout.getvalue())
+
+
 class FileFilterTests(TestCase):
     """Test the FileFilter functionality"""
     
@@ -239,6 +882,23 @@ class FileFilterTests(TestCase):
         self.assertEqual(filtered_qs.count(), 1)
         self.assertEqual(filtered_qs[0].id, self.file2.id)
     
+    def test_date_filter(self):
+        """Test filtering by upload date, inclusive of both days"""
+        today = timezone.now().date()
+        for file_obj, days_ago in ((self.file2, 1), (self.file3, 7)):
+            uploaded_at = timezone.make_aware(datetime.combine(today - timedelta(days=days_ago), datetime.min.time()))
+            File.objects.filter(pk=file_obj.pk).update(uploaded_at=uploaded_at)
+        
+        yesterday = (today - timedelta(days=1)).isoformat()
+        filter_set = FileFilter(data={'start_date': yesterday, 'end_date': yesterday}, queryset=File.objects.all())
+        self.assertEqual(list(filter_set.qs), [self.file2])
+    
+    def test_invalid_date_filter(self):
+        """Test a malformed date is rejected instead of being ignored"""
+        filter_set = FileFilter(data={'start_date': 'not-a-date'}, queryset=File.objects.all())
+        self.assertFalse(filter_set.is_valid())
+        self.assertIn('start_date', filter_set.errors)
+    
     def test_duplicate_filter(self):
         """Test filtering by duplicate status"""
         filter_set = FileFilter(data={'is_duplicate': 'true'}, queryset=File.objects.all())
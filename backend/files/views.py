@@ -1,25 +1,74 @@
 from django.shortcuts import render, get_object_or_404
-from rest_framework import viewsets, status, filters
+from rest_framework import generics, viewsets, status, filters
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet, CharFilter, NumberFilter, DateFilter
-from .models import File, StorageStats
+from .models import (
+    File, HashingUploadedFile, StorageStats, STORAGE_STATS_CACHE_KEY, STORAGE_STATS_VERSION_KEY,
+    bump_cache_version, cache_version, compute_file_hash, compute_path_hash,
+)
 from .serializers import FileSerializer
+from .tasks import compute_hash_and_dedupe, find_original_id, schedule_hash_and_dedupe
 import os
 import mimetypes
-from django.db.models import Sum, Q
-from django.db import transaction
-import tempfile
-import hashlib
+from django.db import IntegrityError, transaction
+from django.core.cache import cache
 from datetime import datetime, timedelta
 from django.utils import timezone
 import logging
-from django.http import FileResponse
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.http import content_disposition_header
+from urllib.parse import quote
+from functools import lru_cache
 
 logger = logging.getLogger('files')  # Get logger specific to files app
 
 # Create your views here.
 
+# Cache key for the file_types response, versioned through FILE_TYPES_VERSION_KEY
+# which is bumped whenever files are added or removed
+FILE_TYPES_CACHE_KEY = 'file_types_v1'
+FILE_TYPES_VERSION_KEY = 'file_types_version'
+
+# Fixed size buckets offered as filters; they don't depend on the stored files
+SIZE_RANGES = [
+    {'label': '0-1MB', 'min': 0, 'max': 1024 * 1024},
+    {'label': '1-5MB', 'min': 1024 * 1024, 'max': 5 * 1024 * 1024},
+    {'label': '5-10MB', 'min': 5 * 1024 * 1024, 'max': 10 * 1024 * 1024},
+    {'label': '10-50MB', 'min': 10 * 1024 * 1024, 'max': 50 * 1024 * 1024},
+    {'label': '50MB+', 'min': 50 * 1024 * 1024, 'max': None}
+]
+
+# Load the MIME tables at import rather than on the first request that needs them
+mimetypes.init()
+
+@lru_cache(maxsize=256)
+def _guess_type_for_extension(extension):
+    return mimetypes.guess_type(f"file{extension}")[0]
+
+def guess_file_type(filename):
+    """Guess a file's MIME type from its name, memoized per extension"""
+    file_type = _guess_type_for_extension(os.path.splitext(filename)[1].lower())
+    if file_type is None:
+        # Compound suffixes such as .tar.gz only resolve from the full name
+        file_type = mimetypes.guess_type(filename)[0]
+    return file_type or 'application/octet-stream'
+
+@lru_cache(maxsize=256)
+def guess_extension(content_type):
+    """Memoized mimetypes.guess_extension"""
+    return mimetypes.guess_extension(content_type)
+
+class FileCursorPagination(CursorPagination):
+    """Keyset pagination for the file list"""
+    # Pages seek on the ordering column instead of OFFSET, and no COUNT(*) is run
+    ordering = '-uploaded_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
 class FileFilter(FilterSet):
     """Custom filter for File model"""
     filename = CharFilter(field_name='original_filename', lookup_expr='icontains')
@@ -37,139 +86,204 @@ class FileFilter(FilterSet):
             return queryset.filter(is_duplicate=False)
         return queryset
     
-    def filter_start_date(self, queryset, name, value):        
-        try:
-            # Convert to datetime and make timezone-aware
-            start_datetime = timezone.make_aware(
-                datetime.combine(value, datetime.min.time())
-            )
-            
-            # Filter files uploaded on or after this date
-            filtered = queryset.filter(uploaded_at__gte=start_datetime)
-            
-            return filtered
-        except Exception as e:
-            logger.error(f"Error in filter_start_date: {str(e)}")
-            return queryset
+    def filter_start_date(self, queryset, name, value):
+        # Filter files uploaded on or after the start of this day. Malformed
+        # dates never reach here: the filter form rejects them with a 400
+        start_datetime = timezone.make_aware(datetime.combine(value, datetime.min.time()))
+        return queryset.filter(uploaded_at__gte=start_datetime)
     
-    def filter_end_date(self, queryset, name, value):        
-        try:
-            # Convert to datetime and make timezone-aware
-            end_datetime = timezone.make_aware(
-                datetime.combine(value, datetime.max.time())
-            )
-            
-            # Filter files uploaded on or before this date
-            filtered = queryset.filter(uploaded_at__lte=end_datetime)
-            
-            return filtered
-        except Exception as e:
-            logger.error(f"Error in filter_end_date: {str(e)}")
-            return queryset
+    def filter_end_date(self, queryset, name, value):
+        # Filter files uploaded on or before the end of this day
+        end_datetime = timezone.make_aware(datetime.combine(value, datetime.max.time()))
+        return queryset.filter(uploaded_at__lte=end_datetime)
     
     class Meta:
         model = File
         fields = ['filename', 'file_type', 'min_size', 'max_size', 'start_date', 'end_date', 'is_duplicate']
 
 class FileViewSet(viewsets.ModelViewSet):
-    queryset = File.objects.all()
+    # Only load the columns the serializer renders (file_hash is never sent)
+    queryset = File.objects.only(*FileSerializer.Meta.fields)
     serializer_class = FileSerializer
+    pagination_class = FileCursorPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_class = FileFilter
     search_fields = ['original_filename']
     ordering_fields = ['uploaded_at', 'original_filename', 'size', 'file_type']
     ordering = ['-uploaded_at']
 
-    def _update_storage_stats(self):
-        """Update storage statistics"""
-        stats, _ = StorageStats.objects.get_or_create(pk=1)
-        
-        # Calculate total storage used (only counting unique files)
-        total_storage = File.objects.filter(is_duplicate=False).aggregate(
-            total=Sum('size'))['total'] or 0
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'download':
+            # Downloading a duplicate serves its original's file, so fetch both in one query
+            queryset = queryset.select_related('original_file')
+        return queryset
+
+    def _calculate_file_hash(self, file_obj):
+        """Calculate hash of a file object without saving it"""
+        if hasattr(file_obj, 'temporary_file_path'):
+            # Spooled to disk by Django: hash the temp file by path (mmap when large,
+            # sized from the upload itself) and leave the upload's own stream alone.
+            # FileSystemStorage then moves it into place rather than copying it.
+            return compute_path_hash(file_obj.temporary_file_path(), file_obj.size)
         
-        # Calculate total storage that would have been used without deduplication
-        # This is the sum of all file sizes (including duplicates)
-        total_potential_storage = File.objects.aggregate(
-            total=Sum('size'))['total'] or 0
+        file_obj.seek(0)
+        # In-memory uploads expose a BytesIO that file_digest consumes zero-copy
+        file_hash = compute_file_hash(file_obj.file)
+        # Rewind so the storage backend sees the full stream on save
+        file_obj.seek(0)
+        return file_hash
+
+    def _backfill_file_hashes(self, size):
+        """Hash stored files of the given size that were saved without a hash"""
+        # Pending files are already queued for the background task, which also
+        # dedupes them against this upload once it lands
+        unhashed = File.objects.filter(
+            size=size, is_duplicate=False, file_hash__isnull=True
+        ).exclude(hash_status=File.HashStatus.PENDING)
+        for candidate_id in unhashed.values_list('id', flat=True):
+            # Same work as the background task, which also folds together any
+            # unhashed originals that turn out to share content
+            try:
+                compute_hash_and_dedupe(candidate_id)
+            except OSError:
+                # An unreadable stored file must not fail someone else's upload
+                logger.exception("Could not hash stored file %s during backfill", candidate_id)
+
+    def _hash_upload_if_needed(self, file_obj):
+        """Hash an upload only when another file of its size exists, else return None"""
+        # A duplicate must have the same size, so only pay for a full hash
+        # when another file of this size already exists
+        if not File.objects.filter(size=file_obj.size).exists():
+            return None
+        file_hash = self._calculate_file_hash(file_obj)
+        # Each stored file is hashed and saved in its own transaction, so this
+        # runs before the upload's transaction rather than holding it open
+        self._backfill_file_hashes(file_obj.size)
+        return file_hash
+
+    def _store_upload(self, file_obj, file_hash):
+        """Save an upload, linking it to the original with the same hash if there is one"""
+        original_id = None
+        if file_hash is not None:
+            # Check for an original file with same hash; only its id is needed to link to it
+            original_id = find_original_id(file_hash)
         
-        # Calculate storage saved (only from duplicates)
-        # This is the difference between what would have been used and what is actually used
-        storage_saved = total_potential_storage - total_storage
+        if original_id is None:
+            try:
+                with transaction.atomic():
+                    return self._save_upload(file_obj, file_hash)
+            except IntegrityError:
+                if file_hash is None:
+                    raise
+                # A concurrent upload of the same content was saved first; the unique
+                # constraint on originals caught it, so link to that one instead
+                original_id = find_original_id(file_hash)
+                if original_id is None:
+                    raise
         
-        # Update stats
-        stats.total_storage_used = total_storage
-        stats.total_storage_saved = storage_saved
-        stats.total_files = File.objects.count()
-        stats.total_unique_files = File.objects.filter(is_duplicate=False).count()
-        stats.save()
+        return self._save_upload(file_obj, file_hash, original_id)
 
-    def _calculate_file_hash(self, file_obj):
-        """Calculate hash of a file object without saving it"""
-        sha256_hash = hashlib.sha256()
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            for chunk in file_obj.chunks():
-                temp_file.write(chunk)
-                sha256_hash.update(chunk)
-            temp_file_path = temp_file.name
+    def _save_upload(self, file_obj, file_hash, original_id=None):
+        """Save the File row for an upload, storing its content only if it is unique"""
+        file_instance = File(
+            original_filename=file_obj.name,
+            file_type=file_obj.content_type or guess_file_type(file_obj.name),
+            size=file_obj.size,
+            file_hash=file_hash,
+            is_duplicate=original_id is not None,
+            original_file_id=original_id
+        )
+        hashing_upload = None
+        if original_id is None:
+            if file_hash is None and not hasattr(file_obj, 'temporary_file_path'):
+                # In-memory uploads are copied into storage anyway, so hash them during
+                # that copy. Spooled uploads are moved into place without being read,
+                # so those are still hashed in the background.
+                file_obj = hashing_upload = HashingUploadedFile(file_obj)
+            # Only unique files are written to storage
+            file_instance.file = file_obj
+        if file_hash is None:
+            # Hash in the background so the request isn't held for it
+            file_instance.hash_status = File.HashStatus.PENDING
+        try:
+            # The UUID pk is generated client-side, so this is a single INSERT
+            file_instance.save()
+            hash_recorded = (
+                hashing_upload is not None
+                and self._record_streamed_hash(file_instance, hashing_upload.hexdigest())
+            )
+        except Exception:
+            # The blob is written before the INSERT and the error rolls the row back,
+            # so remove the blob along with it
+            if file_instance.file:
+                file_instance.file.delete(save=False)
+            raise
         
+        if hash_recorded:
+            return file_instance
+        if file_instance.file_hash is None:
+            schedule_hash_and_dedupe(file_instance.id)
+        return file_instance
+
+    def _record_streamed_hash(self, file_instance, file_hash):
+        """Store the hash computed while the upload was written, if no original has it"""
+        file_instance.file_hash = file_hash
+        file_instance.hash_status = File.HashStatus.COMPLETE
         try:
-            os.unlink(temp_file_path)
-        except:
-            pass
-            
-        return sha256_hash.hexdigest()
+            with transaction.atomic():
+                file_instance.save(update_fields=['file_hash', 'hash_status'])
+        except IntegrityError:
+            # The same content was stored concurrently; the background task folds
+            # this upload into that original
+            file_instance.file_hash = None
+            file_instance.hash_status = File.HashStatus.PENDING
+            return False
+        return True
+
+    def _invalidate_file_types(self):
+        """Retire the cached file_types list once the current change is committed"""
+        transaction.on_commit(lambda: bump_cache_version(FILE_TYPES_VERSION_KEY))
 
-    @transaction.atomic
     def create(self, request, *args, **kwargs):
         file_obj = request.FILES.get('file')
         if not file_obj:
             return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            # Calculate file hash before saving
-            file_hash = self._calculate_file_hash(file_obj)
+            file_hash = self._hash_upload_if_needed(file_obj)
             
-            # Check for existing file with same hash
-            existing_file = File.objects.filter(file_hash=file_hash).first()
+            file_instance = None
+            try:
+                # Roll back the row and the stats together if either fails
+                with transaction.atomic():
+                    file_instance = self._store_upload(file_obj, file_hash)
+                    
+                    # Update storage statistics
+                    StorageStats.record_file(file_instance.size, file_instance.is_duplicate)
+                    self._invalidate_file_types()
+            except Exception:
+                # The row was rolled back, so don't leave its stored blob behind
+                if file_instance is not None and file_instance.file:
+                    file_instance.file.delete(save=False)
+                raise
             
-            if existing_file:
-                # This is a duplicate file
-                file_instance = File(
-                    original_filename=file_obj.name,
-                    file_type=file_obj.content_type or mimetypes.guess_type(file_obj.name)[0] or 'application/octet-stream',
-                    size=file_obj.size,
-                    file_hash=file_hash,
-                    is_duplicate=True,
-                    original_file=existing_file
-                )
-                file_instance.save()
-                
+            if file_instance.is_duplicate:
                 response_data = {
                     'message': 'Duplicate file detected',
-                    'original_file_id': str(existing_file.id),
+                    'original_file_id': str(file_instance.original_file_id),
                     'is_duplicate': True
                 }
             else:
-                # This is a unique file
-                file_instance = File(
-                    file=file_obj,
-                    original_filename=file_obj.name,
-                    file_type=file_obj.content_type or mimetypes.guess_type(file_obj.name)[0] or 'application/octet-stream',
-                    size=file_obj.size,
-                    file_hash=file_hash,
-                    is_duplicate=False
-                )
-                file_instance.save()
                 response_data = {'is_duplicate': False}
             
-            # Update storage statistics
-            self._update_storage_stats()
-            
             # Add file data to response
             serializer = self.get_serializer(file_instance)
             response_data.update(serializer.data)
             
+            # Uploads still being hashed may yet be folded into an existing original
+            if file_instance.hash_status == File.HashStatus.PENDING:
+                return Response(response_data, status=status.HTTP_202_ACCEPTED)
             return Response(response_data, status=status.HTTP_201_CREATED)
             
         except Exception as e:
@@ -178,10 +292,28 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
-        self.perform_destroy(instance)
-        self._update_storage_stats()
+        # Read only what's needed to undo the file's storage, not a full instance
+        pk = kwargs[self.lookup_field]
+        row = generics.get_object_or_404(File.objects.values('file', 'size', 'is_duplicate'), pk=pk)
+        
+        # Duplicates keep their rows but lose the link, as on_delete=SET_NULL would.
+        # Doing it here lets the row go in one DELETE, without the collector loading
+        # it first; File has no delete signals for that to skip.
+        File.objects.filter(original_file=pk).update(original_file=None)
+        queryset = File.objects.filter(pk=pk)
+        if not queryset._raw_delete(queryset.db):
+            # A concurrent request deleted it after our read; it already undid the stats
+            raise Http404
+        
+        if row['file'] and not row['is_duplicate']:
+            # Only remove the blob once the row is really gone
+            storage = File._meta.get_field('file').storage
+            transaction.on_commit(lambda: storage.delete(row['file']))
+        
+        StorageStats.record_file(row['size'], row['is_duplicate'], sign=-1)
+        self._invalidate_file_types()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['get'])
@@ -200,7 +332,7 @@ class FileViewSet(viewsets.ModelViewSet):
             
             # Get the absolute path of the file
             file_path = file_obj.file.path
-            logger.debug(f"Attempting to serve file from path: {file_path}")
+            logger.debug("Attempting to serve file from path: %s", file_path)
             
             # Check if file exists
             if not os.path.exists(file_path):
@@ -212,16 +344,13 @@ class FileViewSet(viewsets.ModelViewSet):
             
             # Open the file without using a context manager
             try:
-                # Open the file in binary read mode
-                file_handle = open(file_path, 'rb')
-                
                 # Get the content type and extension
                 content_type = file_obj.file_type
                 if not content_type:
-                    content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+                    content_type = guess_file_type(file_path)
                 
                 # Get the extension from mimetypes
-                extension = mimetypes.guess_extension(content_type)
+                extension = guess_extension(content_type)
                 if not extension:
                     # If mimetypes can't determine the extension, try to get it from the original filename
                     extension = os.path.splitext(file_obj.original_filename)[1]
@@ -232,7 +361,18 @@ class FileViewSet(viewsets.ModelViewSet):
                     # Remove any existing extension and add the correct one
                     filename = os.path.splitext(filename)[0] + extension
                 
-                # Create a FileResponse with the open file handle
+                if settings.FILE_DOWNLOAD_ACCEL_REDIRECT:
+                    # Let nginx send the file from disk; no bytes pass through Python
+                    response = HttpResponse(content_type=content_type)
+                    response['X-Accel-Redirect'] = settings.FILE_DOWNLOAD_ACCEL_REDIRECT.rstrip('/') + '/' + quote(file_obj.file.name)
+                    response['Content-Disposition'] = content_disposition_header(True, filename)
+                    return response
+                
+                # Open the file in binary read mode
+                file_handle = open(file_path, 'rb')
+                
+                # Create a FileResponse with the open file handle; the WSGI server's
+                # file_wrapper can then use sendfile(2)
                 response = FileResponse(file_handle, as_attachment=True, filename=filename)
                 response['Content-Type'] = content_type
                 
@@ -259,40 +399,46 @@ class FileViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def storage_stats(self, request):
         """Get storage statistics"""
+        # Read the version first, so a write committing mid-request retires what we store
+        version = cache_version(STORAGE_STATS_VERSION_KEY)
+        data = cache.get(STORAGE_STATS_CACHE_KEY, version=version)
+        if data is not None:
+            return Response(data)
+        
         stats = StorageStats.objects.first()
         if not stats:
             stats = StorageStats.objects.create()
         
-        return Response({
+        data = {
             'total_storage_used': stats.total_storage_used,
             'total_storage_saved': stats.total_storage_saved,
             'total_files': stats.total_files,
             'total_unique_files': stats.total_unique_files,
             'last_updated': stats.last_updated,
-            'storage_saved_percentage': (stats.total_storage_saved / (stats.total_storage_used + stats.total_storage_saved) * 100) if (stats.total_storage_used + stats.total_storage_saved) > 0 else 0
-        })
+            'storage_saved_percentage': stats.storage_saved_percentage
+        }
+        # StorageStats bumps the version whenever the counters change
+        cache.set(STORAGE_STATS_CACHE_KEY, data, timeout=300, version=version)
+        return Response(data)
     
     @action(detail=False, methods=['get'])
     def file_types(self, request):
         """Get list of unique file types"""
-        # Use distinct() to ensure we get unique file types
-        file_types = File.objects.values_list('file_type', flat=True).distinct().order_by('file_type')
-        # Convert to list and remove any duplicates that might still exist
-        file_types_list = list(file_types)
-        unique_file_types = list(dict.fromkeys(file_types_list))
-        return Response(unique_file_types)
+        # Read the version first, so a write committing mid-request retires what we store
+        version = cache_version(FILE_TYPES_VERSION_KEY)
+        file_types = cache.get(FILE_TYPES_CACHE_KEY, version=version)
+        if file_types is None:
+            # DISTINCT with an explicit order_by yields each type exactly once
+            file_types = list(
+                File.objects.values_list('file_type', flat=True).distinct().order_by('file_type')
+            )
+            cache.set(FILE_TYPES_CACHE_KEY, file_types, timeout=300, version=version)
+        return Response(file_types)
     
     @action(detail=False, methods=['get'])
     def size_ranges(self, request):
         """Get file size ranges for filtering"""
-        ranges = [
-            {'label': '0-1MB', 'min': 0, 'max': 1024 * 1024},
-            {'label': '1-5MB', 'min': 1024 * 1024, 'max': 5 * 1024 * 1024},
-            {'label': '5-10MB', 'min': 5 * 1024 * 1024, 'max': 10 * 1024 * 1024},
-            {'label': '10-50MB', 'min': 10 * 1024 * 1024, 'max': 50 * 1024 * 1024},
-            {'label': '50MB+', 'min': 50 * 1024 * 1024, 'max': None}
-        ]
-        return Response(ranges)
+        return Response(SIZE_RANGES)
     
     @action(detail=False, methods=['get'])
     def date_ranges(self, request):
@@ -306,10 +452,3 @@ class FileViewSet(viewsets.ModelViewSet):
             {'label': 'This year', 'start': today.replace(month=1, day=1).isoformat(), 'end': today.isoformat()}
         ]
         return Response(ranges)
-
-    def get_queryset(self):
-        queryset = File.objects.all()
-        search_query = self.request.query_params.get('search', None)
-        if search_query:
-            queryset = queryset.filter(original_filename__icontains=search_query)
-        return queryset
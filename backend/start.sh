@@ -4,11 +4,22 @@
 mkdir -p /app/data
 chmod -R 777 /app/data
 
-# Run migrations
+# Run migrations; schema changes ship as committed migrations, so existing
+# databases are upgraded in place
 echo "Running migrations..."
-python manage.py makemigrations
 python manage.py migrate
 
+# Background hashing runs in-process, so uploads queued when the previous
+# server stopped are still pending; finish them alongside the new server
+python manage.py hash_pending &
+
 # Start server
+# Threaded workers let concurrent uploads hash in parallel, since hashing
+# releases the GIL on large buffers. Keep one worker unless REDIS_URL is set,
+# as the local-memory cache is not shared between processes.
 echo "Starting server..."
-gunicorn --bind 0.0.0.0:8000 core.wsgi:application 
\ No newline at end of file
+gunicorn --bind 0.0.0.0:8000 \
+  --worker-class gthread \
+  --workers "${GUNICORN_WORKERS:-1}" \
+  --threads "${GUNICORN_THREADS:-4}" \
+  core.wsgi:application 
\ No newline at end of file
@@ -1,5 +1,5 @@
 import React, { useState, useCallback, useMemo } from 'react';
-import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
+import { useQuery, useInfiniteQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import { fileService } from '../services/fileService';
 import { File as FileType, FileFilter } from '../types/file';
 import { DocumentIcon, TrashIcon, ArrowDownTrayIcon, ChartBarIcon, InformationCircleIcon } from '@heroicons/react/24/outline';
@@ -18,12 +18,23 @@ export const FileList: React.FC = () => {
   const [filters, setFilters] = useState<FileFilter>({});
 
   // Query for fetching files with filters
-  const { data: files, isLoading: filesLoading, error: filesError } = useQuery({
+  const {
+    data: filePages,
+    isLoading: filesLoading,
+    error: filesError,
+    fetchNextPage,
+    hasNextPage,
+    isFetchingNextPage,
+  } = useInfiniteQuery({
     queryKey: ['files', filters],
-    queryFn: () => fileService.getFiles(filters),
+    queryFn: ({ pageParam }) => fileService.getFiles(filters, pageParam),
+    initialPageParam: undefined as string | undefined,
+    getNextPageParam: (lastPage) => lastPage.next ?? undefined,
     staleTime: 30000, // Consider data fresh for 30 seconds
   });
 
+  const files = useMemo(() => filePages?.pages.flatMap((page) => page.results), [filePages]);
+
   // Query for fetching storage stats
   const { data: stats, isLoading: statsLoading } = useQuery({
     queryKey: ['storageStats'],
@@ -174,9 +185,20 @@ export const FileList: React.FC = () => {
             </li>
           ))}
         </ul>
+        {hasNextPage && (
+          <div className="mt-6 text-center">
+            <button
+              onClick={() => fetchNextPage()}
+              disabled={isFetchingNextPage}
+              className="inline-flex items-center px-4 py-2 border border-gray-300 shadow-sm text-sm font-medium rounded-md text-gray-700 bg-white hover:bg-gray-50 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-primary-500"
+            >
+              {isFetchingNextPage ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     );
-  }, [files, filesLoading, filesError, filters, handleDelete, handleDownload, deleteMutation.isPending, downloadMutation.isPending]);
+  }, [files, filesLoading, filesError, filters, handleDelete, handleDownload, deleteMutation.isPending, downloadMutation.isPending, hasNextPage, isFetchingNextPage, fetchNextPage]);
 
   // Memoize the storage stats content to prevent unnecessary re-renders
   const storageStatsContent = useMemo(() => {
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { File as FileType, StorageStats, FileFilter, SizeRange, DateRange } from '../types/file';
+import { File as FileType, FilePage, StorageStats, FileFilter, SizeRange, DateRange } from '../types/file';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000/api';
 
@@ -25,8 +25,15 @@ const getExtensionFromContentType = (contentType: string): string | null => {
 };
 
 const fileService = {
-  // Get all files with optional filtering
-  getFiles: async (filters?: FileFilter): Promise<FileType[]> => {
+  // Get a page of files with optional filtering; pass the previous page's
+  // `next` link to fetch the page after it
+  getFiles: async (filters?: FileFilter, pageUrl?: string): Promise<FilePage> => {
+    if (pageUrl) {
+      // Cursor links already carry the filter params
+      const response = await axios.get(pageUrl);
+      return response.data;
+    }
+    
     const params = new URLSearchParams();
     
     if (filters) {
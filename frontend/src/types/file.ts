@@ -10,6 +10,12 @@ export interface File {
   file_hash: string;
 }
 
+export interface FilePage {
+  next: string | null;
+  previous: string | null;
+  results: File[];
+}
+
 export interface StorageStats {
   total_storage_used: number;
   total_storage_saved: number;